@@ -9,6 +9,7 @@
 
 use anyhow::{Context, Result};
 use thiserror::Error;
+use tonic::codec::CompressionEncoding;
 use tonic::transport::Channel;
 use tracing::{debug, error, info};
 use std::time::Duration;
@@ -24,6 +25,9 @@ use recommendations::{
     ScoreRequest,
 };
 
+/// Maximum size of a decoded response, matching the Python service's limit
+const MAX_MESSAGE_SIZE: usize = 64 * 1024 * 1024;
+
 /// Errors that can occur when interacting with the ML service
 #[derive(Error, Debug)]
 pub enum MLClientError {
@@ -57,7 +61,8 @@ impl MLScorerClient {
     /// A connected client ready to score candidates
     /// 1. Use tonic::transport::Channel::from_shared(addr)?
     /// 2. Call .connect().await to establish connection
-    /// 3. Create GrpcMlScorerClient::new(channel)
+    /// 3. Create GrpcMlScorerClient::new(channel), accepting gzip-compressed
+    ///    responses (the Python service compresses them)
     /// 4. Return MLScorerClient { client, service_addr }
     ///
     /// Error handling:
@@ -75,7 +80,9 @@ impl MLScorerClient {
             .await
             .context("Connecting to ML service")?;
 
-        let client = GrpcMlScorerClient::new(channel);
+        let client = GrpcMlScorerClient::new(channel)
+            .accept_compressed(CompressionEncoding::Gzip)
+            .max_decoding_message_size(MAX_MESSAGE_SIZE);
         Ok(MLScorerClient {
             client,
             service_addr: addr,
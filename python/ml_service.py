@@ -4,10 +4,24 @@ This service receives candidate features from the Rust pipeline and returns
 ML scores for ranking.
 """
 
+import os
+
+# Keep BLAS/OpenMP single-threaded: concurrency comes from the gRPC thread
+# pool, and nested BLAS thread pools per request would oversubscribe cores.
+# Must be set before numpy/scipy are imported.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
 import grpc
 from concurrent import futures
 from pathlib import Path
+from typing import Optional
+import itertools
 import logging
+import multiprocessing
+import signal
+import numpy as np
 from grpc_reflection.v1alpha import reflection 
 
 from generated import (
@@ -25,6 +39,23 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# None of the log formats use thread/process fields; skip collecting them per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+# Log an aggregate INFO line every N requests instead of one per request
+LOG_EVERY_N_REQUESTS = 1000
+
+# Allow large candidate batches (gRPC's default receive limit is 4 MB)
+MAX_MESSAGE_LENGTH = 64 << 20
+
+# Server channel options shared by every serving process
+SERVER_OPTIONS = [
+    ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+    ("grpc.keepalive_time_ms", 30000),
+]
 
 
 class MLScorerService(MLScorerServicer):
@@ -37,6 +68,11 @@ class MLScorerService(MLScorerServicer):
     4. Returns scores array
     """
 
+    # Weight applied to the CF score from the collaborative filtering model
+    CF_WEIGHT = 0.4
+    # Weights for (genre_overlap, collaborative, popularity_percentile, year_preference)
+    FEATURE_WEIGHTS = np.array([0.25, 0.2, 0.1, 0.05], dtype=np.float32)
+
     def __init__(self, model_path: Path, matrix_path: Path):
         """Initialize the ML scoring service.
 
@@ -50,6 +86,9 @@ class MLScorerService(MLScorerServicer):
         # Load the model on initialization
         self.cf_model.load()    
 
+        # next() on itertools.count is atomic under the GIL, so no lock is needed
+        self._requests_served = itertools.count(1)
+
         logger.info("✓ ML Scorer Service initialized")
 
     def ScoreCandidates(
@@ -68,19 +107,18 @@ class MLScorerService(MLScorerServicer):
 
         Steps:
         1. Extract user_id and features list from request
-        2. For each CandidateFeatures:
-           a. Compute CF score using self.cf_model.compute_cf_score()
-           b. Combine with other features using weighted formula
-           c. Example weights (adjust as needed):
-              - cf_score: 40%
-              - genre_overlap_score: 25%
-              - collaborative_score: 20%
-              - popularity_percentile: 10%
-              - year_preference_score: 5%
-        3. Return ScoreResponse with scores list
+        2. Compute CF scores for all candidates with a single
+           self.cf_model.batch_score() call
+        3. Combine with other features using a vectorized weighted formula:
+           - cf_score: 40%
+           - genre_overlap_score: 25%
+           - collaborative_score: 20%
+           - popularity_percentile: 10%
+           - year_preference_score: 5%
+        4. Return ScoreResponse with scores list
 
         Error handling:
-        - If scoring fails, log error and return default scores (e.g., 0.5)
+        - If CF scoring fails, log error and return default scores (0.5)
         - Use context.abort() for critical errors
         """
         # Extract user_id and features
@@ -88,50 +126,117 @@ class MLScorerService(MLScorerServicer):
             user_id = request.user_id
             features_list = request.features
 
-            logger.debug(f"Scoring {len(features_list)} candidates for user_id={user_id}")
+            logger.debug("Scoring %d candidates for user_id=%d", len(features_list), user_id)
 
             if len(features_list) == 0:
                 logger.warning("Received empty features list")
                 return ScoreResponse(scores=[])
-            
-            scores = []
-
-            # Process each candidate
-            for feature in features_list:
-                try:
-                    # Compute CF score
-                    cf_score = self.cf_model.compute_cf_score(user_id, feature.movie_id)
-
-                    # Combine scores with weights
-                    final_score = (
-                        0.4 * cf_score +
-                        0.25 * feature.genre_overlap_score +
-                        0.2 * feature.collaborative_score +
-                        0.1 * feature.popularity_percentile +
-                        0.05 * feature.year_preference_score
-                    )
-                    # Ensure score is within [0, 1]
-                    final_score = max(0.0, min(1.0, final_score))
-                    scores.append(final_score)
-                except Exception as e:
-                    # If scoring a single candidate fails, log and assign default score
-                    logger.error(f"Error scoring candidate movie_id={feature.movie_id}: {e}")
-                    scores.append(0.5)  # Default score on error
-                
-            logger.info(
-                f"Successfully scored {len(scores)} candidates for user_id={user_id}"
-                f"(avg: {sum(scores)/len(scores):.3f})"
-            )
-            return ScoreResponse(scores=scores)
-        
+
+            # Read each message's fields once into pre-allocated buffers
+            n_candidates = len(features_list)
+            movie_ids = np.empty(n_candidates, dtype=np.int64)
+            feats = np.empty((n_candidates, 4), dtype=np.float32)
+            for i, feature in enumerate(features_list):
+                movie_ids[i] = feature.movie_id
+                feats[i, 0] = feature.genre_overlap_score
+                feats[i, 1] = feature.collaborative_score
+                feats[i, 2] = feature.popularity_percentile
+                feats[i, 3] = feature.year_preference_score
+
+            # Pre-allocate the output, filled with the default score for the error path
+            scores = np.full(n_candidates, 0.5, dtype=np.float32)
+
+            try:
+                # Compute CF scores for the whole batch (one neighbor lookup)
+                cf_scores = self.cf_model.batch_score(user_id, movie_ids)
+
+                # Combine scores with weights
+                np.multiply(cf_scores, self.CF_WEIGHT, out=scores)
+                scores += feats @ self.FEATURE_WEIGHTS
+                # Ensure scores are within [0, 1]
+                np.clip(scores, 0.0, 1.0, out=scores)
+            except Exception as e:
+                # If CF scoring fails, log and assign default scores
+                logger.error(f"Error scoring candidates for user_id={user_id}: {e}")
+                scores.fill(0.5)  # Default score on error
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Successfully scored %d candidates for user_id=%d (avg: %.3f)",
+                    len(scores), user_id, scores.mean(),
+                )
+            served = next(self._requests_served)
+            if served % LOG_EVERY_N_REQUESTS == 0:
+                logger.info("Served %d scoring requests", served)
+            return ScoreResponse(scores=scores.tolist())
+
         except Exception as e:
             logger.critical(f"Critical error in ScoreCandidates: {e}", exc_info=True)
             context.abort(grpc.StatusCode.INTERNAL, "Internal server error")
 
+def _serve_one(
+    service: MLScorerService,
+    port: int,
+    max_workers: int,
+    reuse_port: bool = False,
+) -> None:
+    """Run a single gRPC server process until it is interrupted or terminated.
+
+    Args:
+        service: Initialized MLScorerService to register with the server
+        port: Port to listen on
+        max_workers: Size of the request thread pool
+        reuse_port: Bind with SO_REUSEPORT so several processes can share the port
+    """
+    options = SERVER_OPTIONS + ([("grpc.so_reuseport", 1)] if reuse_port else [])
+
+    # Create gRPC server with thread pool. Responses are gzip-compressed;
+    # clients must accept gzip (the Rust ml-client enables
+    # accept_compressed(CompressionEncoding::Gzip) for this).
+    server = grpc.server(
+        futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="mlscorer",
+        ),
+        options=options,
+        compression=grpc.Compression.Gzip,
+    )
+
+    # Add the MLScorer service
+    add_MLScorerServicer_to_server(service, server)
+    # Enable reflection (add these lines)
+    SERVICE_NAMES = (
+        "recommendations.MLScorer",
+        reflection.SERVICE_NAME,
+    )
+    reflection.enable_server_reflection(SERVICE_NAMES, server)
+    
+    # Bind to port
+    server.add_insecure_port(f'[::]:{port}')
+    logger.info(
+        f"Starting ML Scorer Service on port {port} with {max_workers} workers "
+        f"(pid={os.getpid()})..."
+    )
+    server.start()
+    logger.info(f"ML Scorer Service started on port {port}")
+
+    # Stop gracefully on SIGTERM (sent by serve_multi or a process manager)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(grace=5))
+
+    try:
+        # Keep server running
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        logger.info("Shutting down ML Scorer Service...")
+        server.stop(grace=5)
+    logger.info("ML Scorer Service shut down")
+
+
 def serve(
     port: int = 50051,
     model_path: Path = Path("models/cf_model.pkl"),
     matrix_path: Path = Path("models/user_item_matrix.pkl"),
+    max_workers: int = os.cpu_count() or 4,
 ) -> None:
     """Start the gRPC server.
 
@@ -139,6 +244,9 @@ def serve(
         port: Port to listen on (default: 50051)
         model_path: Path to the trained model
         matrix_path: Path to the user-item matrix
+        max_workers: Size of the request thread pool (default: CPU count).
+            The NumPy/SciPy work in batch_score releases the GIL, so
+            threads scale up to roughly one per core.
 
     Steps:
     1. Create a gRPC server with thread pool executor
@@ -148,39 +256,76 @@ def serve(
     5. Wait for termination (handle Ctrl+C gracefully)
 
     Example:
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
         add_MLScorerServicer_to_server(MLScorerService(...), server)
         server.add_insecure_port(f'[::]:{port}')
         server.start()
         server.wait_for_termination()
     """
-    # Create gRPC server with thread pool
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    _serve_one(MLScorerService(model_path, matrix_path), port, max_workers)
 
-    # Add the MLScorer service
-    add_MLScorerServicer_to_server(
-        MLScorerService(model_path, matrix_path), server
-    )
-    # Enable reflection (add these lines)
-    SERVICE_NAMES = (
-        "recommendations.MLScorer",
-        reflection.SERVICE_NAME,
-    )
-    reflection.enable_server_reflection(SERVICE_NAMES, server)
-    
-    # Bind to port
-    server.add_insecure_port(f'[::]:{port}')
-    logger.info(f"Starting ML Scorer Service on port {port}...")
-    server.start()
-    logger.info(f"ML Scorer Service started on port {port}")
+
+def serve_multi(
+    port: int = 50051,
+    model_path: Path = Path("models/cf_model.pkl"),
+    matrix_path: Path = Path("models/user_item_matrix.pkl"),
+    processes: int = os.cpu_count() or 1,
+    max_workers: Optional[int] = None,
+) -> None:
+    """Start several gRPC server processes sharing one port.
+
+    Python-level work in ScoreCandidates (protobuf decoding, score
+    combining) holds the GIL, so a single process cannot use every core.
+    Each child process runs its own server bound with SO_REUSEPORT and the
+    kernel load-balances incoming connections between them.
+
+    Args:
+        port: Port to listen on (default: 50051)
+        model_path: Path to the trained model
+        matrix_path: Path to the user-item matrix
+        processes: Number of server processes (default: CPU count)
+        max_workers: Size of the request thread pool in each process
+            (default: CPU count divided by processes, at least 1, so the
+            children together run about one thread per core)
+
+    The model is loaded once before forking so the read-only matrix pages
+    are shared copy-on-write between children. No gRPC objects may be
+    created before the fork, which is why each child builds its own server.
+    """
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // processes)
+
+    service = MLScorerService(model_path, matrix_path)
+
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(
+            target=_serve_one,
+            args=(service, port, max_workers, True),
+            name=f"mlscorer-{i}",
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {processes} ML Scorer processes on port {port}")
+
+    def _terminate(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()  # Sends SIGTERM for a graceful stop
+
+    signal.signal(signal.SIGTERM, _terminate)
 
     try:
-        # Keep server running
-        server.wait_for_termination()
+        for worker in workers:
+            worker.join()
     except KeyboardInterrupt:
-        logger.info("Shutting down ML Scorer Service...")
-        server.stop(grace=5)
-        logger.info("ML Scorer Service shut down")
+        # Children receive the same SIGINT from the terminal and stop themselves
+        logger.info("Shutting down ML Scorer processes...")
+        for worker in workers:
+            worker.join()
+    logger.info("All ML Scorer processes shut down")
 
 
 if __name__ == "__main__":
@@ -206,17 +351,40 @@ if __name__ == "__main__":
         default=Path("models/collaborative_filtering/user_item_matrix.pkl"),
         help="Path to the user-item matrix file"
     )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Number of request handler threads per process (default: CPU count, "
+             "or CPU count divided by --processes when running several processes)"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port (default: 1)"
+    )
     
     args = parser.parse_args()
     
     logger.info("Starting ML Scorer Service...")
     
     try:
-        serve(
-            port=args.port,
-            model_path=args.model_path,
-            matrix_path=args.matrix_path
-        )
+        if args.processes > 1:
+            serve_multi(
+                port=args.port,
+                model_path=args.model_path,
+                matrix_path=args.matrix_path,
+                processes=args.processes,
+                max_workers=args.max_workers,
+            )
+        else:
+            serve(
+                port=args.port,
+                model_path=args.model_path,
+                matrix_path=args.matrix_path,
+                max_workers=args.max_workers or os.cpu_count() or 4,
+            )
     except Exception as e:
         logger.error(f"Failed to start service: {e}", exc_info=True)
         exit(1)
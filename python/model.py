@@ -1,17 +1,107 @@
 """ML model wrapper for collaborative filtering."""
 
+import functools
+import os
+import struct
+import threading
+import zipfile
 import joblib
 import numpy as np
 from pathlib import Path
 from typing import Optional
+from scipy.sparse import csr_matrix
 from sklearn.neighbors import NearestNeighbors
 
+try:
+    import hnswlib
+except ImportError:  # Optional: falls back to exact sklearn search
+    hnswlib = None
+
+try:
+    import numba_kernels
+except ImportError:  # Optional: falls back to the NumPy/SciPy scoring path
+    numba_kernels = None
+
+# Max number of users whose nearest neighbors are cached (0 disables caching)
+NEIGHBOR_CACHE_SIZE = int(os.environ.get("CF_NEIGHBOR_CACHE_SIZE", "4096"))
+# Set CF_USE_ANN=0 to force exact sklearn search even if an HNSW index exists
+USE_ANN = os.environ.get("CF_USE_ANN", "1") != "0"
+# HNSW query-time beam width; higher trades speed for recall
+HNSW_EF = int(os.environ.get("CF_HNSW_EF", "100"))
+
+
+def _mmap_npz(path: Path) -> dict[str, np.ndarray]:
+    """Memory-map every array in an uncompressed .npz file.
+
+    np.load ignores mmap_mode for .npz archives and reads members into
+    memory. Uncompressed members can be mapped read-only at their offset
+    inside the zip instead, and the pages are shared between processes
+    through the OS page cache. A member whose data doesn't start on an
+    aligned offset (np.savez doesn't align them) is copied into memory,
+    since misaligned arrays are slow to operate on.
+
+    Args:
+        path: Path to an uncompressed .npz file (not np.savez_compressed)
+
+    Returns:
+        Dict mapping array name to a read-only array, backed by the file
+        when its data is aligned
+
+    Raises:
+        ValueError: If a member is compressed or uses an unsupported format
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed and can't be memory-mapped")
+
+            # Skip the local file header: 30 fixed bytes + file name + extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                raise ValueError(f"{path}: unsupported .npy format version {version}")
+
+            name = info.filename.removesuffix(".npy")
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)  # mmap can't map zero bytes
+            else:
+                array = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+                if not array.flags.aligned:
+                    array = np.array(array)
+                    array.flags.writeable = False
+                arrays[name] = array
+    return arrays
+
+
+def _sorted_id_index(id_to_idx: dict) -> tuple[np.ndarray, np.ndarray]:
+    """Convert an id -> index dict into (ids_sorted, idx_of_sorted) arrays."""
+    ids = np.fromiter(id_to_idx.keys(), dtype=np.int64, count=len(id_to_idx))
+    idx = np.fromiter(id_to_idx.values(), dtype=np.int64, count=len(id_to_idx))
+    order = np.argsort(ids)
+    return ids[order], idx[order]
+
 
 class CollaborativeFilteringModel:
     """Wrapper for the collaborative filtering model used in recommendations.
 
     This class handles:
-    - Loading the trained sklearn NearestNeighbors model
+    - Loading the trained sklearn NearestNeighbors model, plus an
+      approximate HNSW index (hnswlib) for neighbor search when available
     - Loading the user-item matrix
     - Computing collaborative filtering scores for candidates
     """
@@ -21,32 +111,176 @@ class CollaborativeFilteringModel:
 
         Args:
             model_path: Path to the saved sklearn model (.pkl)
-            matrix_path: Path to the saved user-item matrix (.pkl)
+            matrix_path: Path to the saved user-item matrix (.pkl). If a
+                bundle.npz exists alongside it (written by
+                train_model.save_model_bundle), the matrix is memory-mapped
+                from the bundle instead.
         """
         self.model_path = model_path
         self.matrix_path = matrix_path
         self.model: Optional[NearestNeighbors] = None
+        self.hnsw_index = None  # Optional hnswlib.Index used instead of model.kneighbors
         self.user_item_matrix: Optional[np.ndarray] = None
-        self.user_id_to_idx: Optional[dict] = None  # Maps user_id -> matrix row index
-        self.movie_id_to_idx: Optional[dict] = None  # Maps movie_id -> matrix column index
+        # Sorted IDs and the matrix row/column index of each, for np.searchsorted lookup
+        self.user_ids_sorted: Optional[np.ndarray] = None
+        self.user_idx_of_sorted: Optional[np.ndarray] = None
+        self.movie_ids_sorted: Optional[np.ndarray] = None
+        self.movie_idx_of_sorted: Optional[np.ndarray] = None
+        # Per-user mean rating, present when the model was trained on mean-centered ratings
+        self.user_means: Optional[np.ndarray] = None
+
+        # LRU cache of (neighbor_indices, similarities) keyed on user row index
+        self._neighbors = functools.lru_cache(maxsize=NEIGHBOR_CACHE_SIZE)(
+            self._query_neighbors
+        )
+        # Per-thread scratch buffers reused across requests (see _scratch)
+        self._tls = threading.local()
 
     def load(self) -> None:
         """Load the model and user-item matrix from disk.
 
         - Load the sklearn model using joblib
-        - Load the user-item matrix using joblib
-        - Load the movie_id_to_idx mapping if saved separately
+        - Memory-map the matrix, ID lookup arrays and user means from
+          bundle.npz if it exists, otherwise load the matrix and
+          id_to_idx pickles using joblib
+        - Load the HNSW index (hnsw.bin next to the model) if hnswlib is
+          installed and CF_USE_ANN is not disabled
+        - Clear the cached neighbor lookups from any previous load
+        - Compile the Numba scoring kernel, if available, so the first
+          request doesn't pay for it
 
         Raises:
             FileNotFoundError: If model files don't exist
+            ValueError: If the user-item matrix is not int8 or float32
         """
         self.model = joblib.load(self.model_path)
+        # Assuming the bundle / ID mappings are saved alongside the matrix
+        bundle_path = self.matrix_path.parent / "bundle.npz"
+        if bundle_path.exists():
+            self._load_bundle(bundle_path)
+        else:
+            self._load_pickles()
+        # Ratings are stored compactly (int8 for whole-star ratings) and
+        # upcast to float32 only on the slices read while scoring
+        if self.user_item_matrix.dtype not in (np.int8, np.float32):
+            raise ValueError(
+                f"Expected an int8 or float32 user-item matrix, got {self.user_item_matrix.dtype}"
+            )
+        self.hnsw_index = self._load_hnsw_index()
+        self._neighbors.cache_clear()
+        if numba_kernels is not None:
+            numba_kernels.warmup(self.user_item_matrix.dtype)
+
+    def _load_bundle(self, bundle_path: Path) -> None:
+        """Load the serving arrays from the bundle written by train_model.
+
+        Args:
+            bundle_path: Path to the uncompressed bundle.npz
+        """
+        arrays = _mmap_npz(bundle_path)
+        self.user_item_matrix = csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(int(n) for n in arrays["shape"]),
+            copy=False,
+        )
+        # The ID lookups and user_means are small and on every request's
+        # path, so keep them in ordinary memory rather than mapped pages
+        self.movie_ids_sorted = np.array(arrays["movie_ids_sorted"])
+        self.movie_idx_of_sorted = np.array(arrays["movie_idx_of_sorted"])
+        self.user_ids_sorted = np.array(arrays["user_ids_sorted"])
+        self.user_idx_of_sorted = np.array(arrays["user_idx_of_sorted"])
+        self.user_means = np.array(arrays["user_means"]) if "user_means" in arrays else None
+
+    def _load_pickles(self) -> None:
+        """Load artifacts from the joblib pickles when there is no bundle.npz."""
+        model_dir = self.matrix_path.parent
         self.user_item_matrix = joblib.load(self.matrix_path)
-        # Assuming movie_id_to_idx is saved alongside the matrix
-        movie_id_to_idx_path = self.matrix_path.parent / "movie_id_to_idx.pkl"
-        self.movie_id_to_idx = joblib.load(movie_id_to_idx_path)
-        user_id_to_idx_path = self.matrix_path.parent / "user_id_to_idx.pkl"
-        self.user_id_to_idx = joblib.load(user_id_to_idx_path)
+        self.movie_ids_sorted, self.movie_idx_of_sorted = _sorted_id_index(
+            joblib.load(model_dir / "movie_id_to_idx.pkl")
+        )
+        self.user_ids_sorted, self.user_idx_of_sorted = _sorted_id_index(
+            joblib.load(model_dir / "user_id_to_idx.pkl")
+        )
+        # Only written when the model was fit on mean-centered ratings
+        means_path = model_dir / "user_means.pkl"
+        self.user_means = joblib.load(means_path) if means_path.exists() else None
+
+    def _load_hnsw_index(self) -> Optional["hnswlib.Index"]:
+        """Load the approximate neighbor index written by train_model, if usable.
+
+        Returns:
+            The loaded hnswlib.Index, or None to use exact sklearn search
+        """
+        index_path = self.model_path.parent / "hnsw.bin"
+        if not USE_ANN or hnswlib is None or not index_path.exists():
+            return None
+
+        index = hnswlib.Index(space="cosine", dim=self.user_item_matrix.shape[1])
+        index.load_index(str(index_path))
+        index.set_ef(max(HNSW_EF, self.model.n_neighbors))
+        return index
+
+    @staticmethod
+    def _lookup(ids_sorted: np.ndarray, idx_of_sorted: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Resolve IDs to matrix indices with a single vectorized search.
+
+        Args:
+            ids_sorted: Sorted array of known IDs
+            idx_of_sorted: Matrix index for each entry of ids_sorted
+            ids: IDs to resolve
+
+        Returns:
+            Array of matrix indices, -1 where the ID is unknown
+        """
+        pos = np.searchsorted(ids_sorted, ids).clip(max=len(ids_sorted) - 1)
+        hit = ids_sorted[pos] == ids
+        return np.where(hit, idx_of_sorted[pos], -1)
+
+    def _lookup_movie(self, movie_ids: np.ndarray) -> np.ndarray:
+        """Map movie IDs to matrix column indices (-1 for unknown movies)."""
+        return self._lookup(self.movie_ids_sorted, self.movie_idx_of_sorted, movie_ids)
+
+    def _lookup_user(self, user_id: int) -> int:
+        """Map a user ID to its matrix row index (-1 for unknown users)."""
+        return int(self._lookup(self.user_ids_sorted, self.user_idx_of_sorted, user_id))
+
+    def _query_neighbors(self, user_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """Find the nearest neighbors of a user.
+
+        Called through the LRU-cached ``self._neighbors`` so repeat requests
+        for the same user skip the kneighbors query.
+
+        Args:
+            user_idx: Row index of the user in user_item_matrix
+
+        Returns:
+            Tuple of (neighbor_indices, similarities), both read-only 1-D arrays
+        """
+        # 1 x n_movies CSR row; sklearn's brute-force cosine search takes it as is
+        user_vector = self.user_item_matrix[user_idx].astype(np.float32)
+        if self.user_means is not None:
+            # Query in the same mean-centered space the neighbor index was built in
+            user_vector = csr_matrix(
+                (user_vector.data - self.user_means[user_idx], user_vector.indices, user_vector.indptr),
+                shape=user_vector.shape,
+            )
+        if self.hnsw_index is not None:
+            indices, distances = self.hnsw_index.knn_query(
+                user_vector.toarray(), k=self.model.n_neighbors
+            )
+            indices = indices.astype(np.int64)
+        else:
+            distances, indices = self.model.kneighbors(user_vector)
+
+        # Convert cosine distance to similarity
+        # similarity = 1 - distance (ranges from 1 to -1, but usually 0 to 1)
+        neighbor_indices = np.ascontiguousarray(indices.ravel())
+        similarities = np.ascontiguousarray(1 - distances.ravel(), dtype=np.float32)
+
+        # Cached arrays are shared between requests, so guard against mutation
+        neighbor_indices.flags.writeable = False
+        similarities.flags.writeable = False
+        return neighbor_indices, similarities
 
     def compute_cf_score(self, user_id: int, movie_id: int) -> float:
         """Compute collaborative filtering score for a single movie.
@@ -61,100 +295,158 @@ class CollaborativeFilteringModel:
         Returns:
             Float score between 0.0 and 1.0 indicating predicted affinity
 
-        - Get the user's rating vector from user_item_matrix
-        - Use the model to find k nearest neighbors
-        - Compute the predicted rating based on neighbors' ratings
-        - Normalize to 0-1 range
-        - Handle cases where movie_id is not in the matrix (return 0.0?)
+        Delegates to batch_score so both paths share one implementation
+        (including mean-centering when the artifacts provide user means).
+        Returns 0.0 if the user or movie is not in the matrix.
         """
-        # Get user's rating vector
-        if self.user_item_matrix is None or self.movie_id_to_idx is None or self.model is None:
+        if self.user_item_matrix is None or self.movie_ids_sorted is None or self.model is None:
             raise ValueError("Model and matrix must be loaded before scoring.")
-        user_idx = self.user_id_to_idx.get(user_id, None)
-        if user_idx is None or user_idx >= self.user_item_matrix.shape[0]:
-            return 0.0  # User not in matrix
-        user_vector = self.user_item_matrix[user_idx, :].toarray().reshape(1, -1)
-
-        # Find nearest neighbors
-        distances, indices = self.model.kneighbors(user_vector)
-        distances = distances.flatten()
-
-        # Get movie ratings from neighbors
-        movie_idx = self.movie_id_to_idx.get(movie_id, None)
-        if movie_idx is None:
-            return 0.0  # Movie not in matrix
-        
-        neighbor_ratings = self.user_item_matrix[indices.flatten(), movie_idx].toarray().flatten()
-
-        # Filter valid ratings and their corresponding distances
-        valid_mask = neighbor_ratings > 0
-        valid_ratings = neighbor_ratings[valid_mask]
-        valid_distances = distances[valid_mask]
-        if len(valid_ratings) == 0:
-            return 0.0  # No valid ratings from neighbors
-        
-        # Convert cosine distance to similarity weights
-        # similarity = 1 - distance (ranges from 1 to -1, but usually 0 to 1)
-        similarities = 1 - valid_distances
-
-        # Handle edge case: if all similarities are 0 or negative
-        if similarities.sum() <= 0:
-            # Fall back to simple average
-            predicted_rating = np.mean(valid_ratings)
-        else:
-            # Weighted average by similarity
-            predicted_rating = np.average(valid_ratings, weights=similarities)
-        
-        # Normalize to 0-1 range
-        normalized_score = (predicted_rating - 1) / 4  # Assuming ratings are from 1 to 5
-        return normalized_score
+        return float(self.batch_score(user_id, [movie_id])[0])
 
     def batch_score(self, user_id: int, movie_ids: list[int]) -> np.ndarray:
-        """Vectorized batch scoring."""
-        if self.user_item_matrix is None or self.movie_id_to_idx is None:
+        """Vectorized batch scoring.
+
+        Predicts each rating as a similarity-weighted average of the
+        neighbors' ratings. When user means are loaded, neighbors' ratings
+        are centered on their own mean and the result is offset by this
+        user's mean, so heavy and light raters contribute comparably.
+        """
+        if self.user_item_matrix is None or self.movie_ids_sorted is None:
             raise ValueError("Model must be loaded first")
         
-        user_idx = self.user_id_to_idx.get(user_id)
-        if user_idx is None:
-            return np.zeros(len(movie_ids))
-        
-        user_vector = self.user_item_matrix[user_idx, :].toarray().reshape(1, -1)
-        
-        # Find neighbors once
-        distances, indices = self.model.kneighbors(user_vector)
-        neighbor_indices = indices.flatten()
-        distances = distances.flatten()
-        
-        # Convert distances to similarities
-        similarities = 1 - distances
-        
-        scores = []
-        for movie_id in movie_ids:
-            movie_idx = self.movie_id_to_idx.get(movie_id)
-            if movie_idx is None:
-                scores.append(0.0)
-                continue
-            
-            neighbor_ratings = self.user_item_matrix[neighbor_indices, movie_idx].toarray().flatten()
-            
-            # Filter valid ratings and corresponding similarities
-            valid_mask = neighbor_ratings > 0
-            valid_ratings = neighbor_ratings[valid_mask]
-            valid_similarities = similarities[valid_mask]
-            
-            if len(valid_ratings) == 0:
-                scores.append(0.0)
-            else:
-                # Weighted average
-                if valid_similarities.sum() <= 0:
-                    predicted_rating = np.mean(valid_ratings)
-                else:
-                    predicted_rating = np.average(valid_ratings, weights=valid_similarities)
-                
-                normalized_score = (predicted_rating - 1) / 4
-                scores.append(normalized_score)
+        user_idx = self._lookup_user(user_id)
+        if user_idx < 0:
+            return np.zeros(len(movie_ids), dtype=np.float32)
         
-        return np.array(scores)
+        # Find neighbors once (cached per user)
+        neighbor_indices, similarities = self._neighbors(user_idx)
+
+        # Map movie IDs to matrix columns (-1 for movies not in the matrix)
+        movie_cols = self._lookup_movie(np.asarray(movie_ids, dtype=np.int64))
+        valid = movie_cols >= 0
+
+        # Pre-allocate the output; movies not in the matrix score 0.0
+        scores = np.zeros(len(movie_ids), dtype=np.float32)
+        if not valid.any():
+            return scores
+
+        cols = movie_cols[valid]
+        if numba_kernels is not None:
+            scores[valid] = self._score_numba(user_idx, neighbor_indices, similarities, cols)
+            return scores
+
+        # Neighbor rows stay sparse; no dense (n_neighbors, n_movies) block is built
+        block = self.user_item_matrix[neighbor_indices].astype(np.float32, copy=False)
+        # Only positive values count as ratings, matching the Numba kernel.
+        # Other stored values are zeroed on a copy (the block may share the
+        # matrix's data when it is already float32).
+        positive = block.data > 0
+        if not positive.all():
+            block = csr_matrix(
+                (np.where(positive, block.data, 0.0).astype(np.float32), block.indices, block.indptr),
+                shape=block.shape,
+            )
+        # Rated indicator reusing the block's sparsity pattern
+        rated = csr_matrix(
+            (positive.astype(np.float32), block.indices, block.indptr), shape=block.shape
+        )
+
+        # Each sparse product reduces over the neighbors for every movie at once.
+        # Unrated entries are not stored, so they drop out of the sums.
+        # reducer @ block -> similarity-weighted rating sums, plain rating sums
+        # reducer @ rated -> similarity sums, rating counts (plus the
+        #                    neighbor-mean terms when mean-centered)
+        reducer = np.vstack([similarities, np.ones_like(similarities)])
+        num, rating_sum = (reducer @ block)[:, cols]
+
+        if self.user_means is not None:
+            # Center each neighbor's ratings on that neighbor's mean
+            neighbor_means = self.user_means[neighbor_indices]
+            rated_reducer = np.vstack([reducer, reducer * neighbor_means])
+            den, counts, mean_num, mean_sum = (rated_reducer @ rated)[:, cols]
+            num -= mean_num
+            rating_sum -= mean_sum
+            offset = self.user_means[user_idx]
+        else:
+            den, counts = (reducer @ rated)[:, cols]
+            offset = 0.0
+
+        predicted_rating = self._scratch("predicted", (len(cols),), np.float32)
+        predicted_rating.fill(0.0)
+        weighted = den > 0
+        np.divide(num, den, out=predicted_rating, where=weighted)
+
+        # Fall back to a simple average when similarities sum to <= 0
+        fallback = ~weighted & (counts > 0)
+        np.divide(rating_sum, counts, out=predicted_rating, where=fallback)
+        predicted_rating += offset
+
+        # Normalize to 0-1 range in place over the whole vector;
+        # movies without neighbor ratings score 0.0
+        predicted_rating -= 1
+        predicted_rating /= 4
+        np.clip(predicted_rating, 0.0, 1.0, out=predicted_rating)
+        np.copyto(predicted_rating, 0.0, where=counts == 0)
+        scores[valid] = predicted_rating
+        return scores
+
+    def _score_numba(
+        self,
+        user_idx: int,
+        neighbor_indices: np.ndarray,
+        similarities: np.ndarray,
+        cols: np.ndarray,
+    ) -> np.ndarray:
+        """Score movie columns with the fused Numba kernel.
+
+        Args:
+            user_idx: Row index of the user in user_item_matrix
+            neighbor_indices: Row indices of the user's nearest neighbors
+            similarities: Similarity of each neighbor to the user
+            cols: Matrix column indices of the movies to score
+
+        Returns:
+            float32 scores in [0, 1], one per column. This is a view of a
+            thread-local scratch buffer, valid until the next call on this thread.
+        """
+        # Densify the (n_neighbors, n_cols) slab into a reused buffer in the
+        # stored dtype; the kernel upcasts each rating as it reads it
+        sub = self._scratch("sub", (len(neighbor_indices), len(cols)), self.user_item_matrix.dtype)
+        self.user_item_matrix[neighbor_indices][:, cols].toarray(out=sub)
+
+        neighbor_means = self._scratch("neighbor_means", (len(neighbor_indices),), np.float32)
+        if self.user_means is not None:
+            np.take(self.user_means, neighbor_indices, out=neighbor_means)
+            offset = float(self.user_means[user_idx])
+        else:
+            neighbor_means.fill(0.0)
+            offset = 0.0
+
+        out = self._scratch("out", (len(cols),), np.float32)
+        numba_kernels.weighted_average(sub, similarities, neighbor_means, offset, out)
+        return out
+
+    def _scratch(self, name: str, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """Get a reusable per-thread buffer of the given shape and dtype.
+
+        Buffers only ever grow, so after warm-up the scoring path stops
+        allocating for its dense temporaries. Each gRPC worker thread gets
+        its own buffers, so concurrent requests never share one.
+
+        Args:
+            name: Buffer name, one per distinct temporary
+            shape: Shape of the view to return
+            dtype: dtype of the buffer
+
+        Returns:
+            Uninitialized C-contiguous view into the thread's buffer
+        """
+        size = int(np.prod(shape))
+        buffer = getattr(self._tls, name, None)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            setattr(self._tls, name, buffer)
+        return buffer[:size].reshape(shape)
 
 # if __name__ == "__main__":
 #     # Load the model
@@ -0,0 +1,75 @@
+"""Numba-compiled kernels for collaborative filtering scoring.
+
+Numba is an optional dependency; model.py falls back to the NumPy/SciPy
+implementation when it isn't installed.
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(nogil=True, fastmath=True, cache=True)
+def weighted_average(
+    sub: np.ndarray,
+    sims: np.ndarray,
+    neighbor_means: np.ndarray,
+    offset: float,
+    out: np.ndarray,
+) -> None:
+    """Compute normalized CF scores from a dense neighbor rating block.
+
+    Fuses the rated mask, the similarity-weighted average, the simple-average
+    fallback and the 0-1 normalization into one pass over the block, without
+    allocating temporaries.
+
+    Args:
+        sub: (n_neighbors, n_movies) ratings (int8 or float32), 0 where a
+            neighbor hasn't rated
+        sims: (n_neighbors,) neighbor similarities
+        neighbor_means: (n_neighbors,) mean subtracted from each neighbor's
+            ratings (zeros when the model isn't mean-centered)
+        offset: The user's mean rating added back (0.0 when not mean-centered)
+        out: (n_movies,) output buffer, filled with scores in [0, 1]
+    """
+    n_neighbors, n_movies = sub.shape
+    for j in range(n_movies):
+        num = 0.0
+        den = 0.0
+        rating_sum = 0.0
+        count = 0
+        for i in range(n_neighbors):
+            v = sub[i, j]
+            if v > 0:
+                deviation = v - neighbor_means[i]
+                num += sims[i] * deviation
+                den += sims[i]
+                rating_sum += deviation
+                count += 1
+
+        if count == 0:
+            out[j] = 0.0  # No valid ratings from neighbors
+            continue
+
+        # Weighted average, or a simple average if similarities sum to <= 0
+        predicted_rating = offset + (num / den if den > 0 else rating_sum / count)
+        score = (predicted_rating - 1.0) / 4.0
+        out[j] = min(max(score, 0.0), 1.0)
+
+
+def warmup(sub_dtype: np.dtype = np.float32) -> None:
+    """Compile (or load from cache) the kernels so the first request doesn't pay for it.
+
+    Args:
+        sub_dtype: dtype of the stored ratings, which the kernel is specialized on
+    """
+    # Cached similarities are read-only, which Numba types separately from a
+    # writable array, so warm up with the same layout requests will pass
+    sims = np.ones(1, dtype=np.float32)
+    sims.flags.writeable = False
+    weighted_average(
+        np.ones((1, 1), dtype=sub_dtype),
+        sims,
+        np.zeros(1, dtype=np.float32),
+        0.0,
+        np.empty(1, dtype=np.float32),
+    )
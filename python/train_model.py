@@ -12,8 +12,15 @@ import numpy as np
 from pathlib import Path
 from sklearn.neighbors import NearestNeighbors
 import joblib
-from typing import Tuple, Dict
-from scipy.sparse import lil_matrix
+import struct
+import zipfile
+from typing import Tuple, Dict, Optional
+from scipy.sparse import coo_matrix, csr_matrix
+
+try:
+    import hnswlib
+except ImportError:  # Optional: the service falls back to exact sklearn search
+    hnswlib = None
 
 
 def load_ratings(data_dir: Path) -> pd.DataFrame:
@@ -46,7 +53,7 @@ def load_ratings(data_dir: Path) -> pd.DataFrame:
 
 def create_user_item_matrix(
     ratings_df: pd.DataFrame,
-) -> Tuple[lil_matrix, Dict[int, int], Dict[int, int]]:
+) -> Tuple[csr_matrix, Dict[int, int], Dict[int, int]]:
     """Create a user-item matrix from ratings.
 
     Args:
@@ -54,7 +61,7 @@ def create_user_item_matrix(
 
     Returns:
         Tuple of:
-        - user_item_matrix: numpy array of shape (n_users, n_movies)
+        - user_item_matrix: CSR matrix of shape (n_users, n_movies)
         - user_id_to_idx: dict mapping user_id -> row index
         - movie_id_to_idx: dict mapping movie_id -> column index
 
@@ -76,8 +83,9 @@ def create_user_item_matrix(
 
     Alternative: Use scipy.sparse for memory efficiency
     """
-    unique_user_ids = ratings_df["user_id"].unique()
-    unique_movie_ids = ratings_df["movie_id"].unique()
+    # Factorize IDs into 0-based indices (in order of first appearance)
+    user_indices, unique_user_ids = pd.factorize(ratings_df["user_id"])
+    movie_indices, unique_movie_ids = pd.factorize(ratings_df["movie_id"])
 
     user_id_to_idx = {user_id: idx for idx, user_id in enumerate(unique_user_ids)}
     movie_id_to_idx = {movie_id: idx for idx, movie_id in enumerate(unique_movie_ids)}
@@ -85,19 +93,59 @@ def create_user_item_matrix(
     n_users = len(unique_user_ids)
     n_movies = len(unique_movie_ids)
 
-    user_item_matrix = lil_matrix((n_users, n_movies), dtype=np.float32)
+    ratings = ratings_df["rating"].to_numpy(dtype=np.float32)
 
-    # Map IDs to indices using vectorized operations
-    user_indices = ratings_df["user_id"].map(user_id_to_idx).values
-    movie_indices = ratings_df["movie_id"].map(movie_id_to_idx).values
-    ratings = ratings_df["rating"].values
+    # Build directly from (row, col, value) triplets, then convert to CSR for efficiency
+    user_item_matrix = coo_matrix(
+        (ratings, (user_indices.astype(np.int32), movie_indices.astype(np.int32))),
+        shape=(n_users, n_movies),
+    ).tocsr()
+    user_item_matrix.sum_duplicates()
 
-    # Fill the matrix
-    user_item_matrix[user_indices, movie_indices] = ratings
+    return user_item_matrix, user_id_to_idx, movie_id_to_idx
 
-    user_item_matrix = user_item_matrix.tocsr()  # Convert to CSR format for efficiency
 
-    return user_item_matrix, user_id_to_idx, movie_id_to_idx
+def center_user_ratings(user_item_matrix: csr_matrix) -> Tuple[csr_matrix, np.ndarray]:
+    """Center each user's ratings on that user's mean rating.
+
+    Args:
+        user_item_matrix: CSR user-item rating matrix (unrated entries not stored)
+
+    Returns:
+        Tuple of:
+        - centered: CSR matrix with each stored rating minus the user's mean
+        - user_means: float32 array of shape (n_users,) with each user's mean
+
+    Raw cosine similarity favours users who rate many movies highly;
+    centering compares users on which movies they liked more than usual.
+    """
+    n_users = user_item_matrix.shape[0]
+    ratings_per_user = np.diff(user_item_matrix.indptr)
+    rating_sums = np.asarray(user_item_matrix.sum(axis=1)).ravel()
+    user_means = (rating_sums / np.maximum(ratings_per_user, 1)).astype(np.float32)
+
+    centered = user_item_matrix.copy()
+    centered.data -= user_means[np.repeat(np.arange(n_users), ratings_per_user)]
+    return centered, user_means
+
+
+def compact_ratings(user_item_matrix: csr_matrix) -> csr_matrix:
+    """Store whole-star ratings as int8 to shrink the serving matrix.
+
+    Args:
+        user_item_matrix: CSR user-item rating matrix
+
+    Returns:
+        The matrix with int8 data if every rating is a whole number that
+        fits in int8, otherwise the matrix unchanged
+
+    MovieLens 1M ratings are 1-5 stars, so int8 cuts the data array to a
+    quarter of float32. The service upcasts only the slices it reads.
+    """
+    data = user_item_matrix.data
+    if data.size and np.all(np.mod(data, 1) == 0) and data.min() >= 0 and data.max() <= 127:
+        return user_item_matrix.astype(np.int8)
+    return user_item_matrix
 
 
 def train_collaborative_filtering_model(
@@ -130,11 +178,93 @@ def train_collaborative_filtering_model(
     Note: You might want to normalize the matrix first (e.g., center by user mean)
     """
 
-    model = NearestNeighbors(n_neighbors=n_neighbors, metric=metric)
+    # Brute-force search works directly on sparse input, so the service can
+    # query with a sparse user row instead of densifying it
+    model = NearestNeighbors(n_neighbors=n_neighbors, metric=metric, algorithm="brute")
     model.fit(user_item_matrix)
     return model
 
 
+def build_hnsw_index(
+    user_item_matrix: csr_matrix,
+    ef_construction: int = 200,
+    m: int = 16,
+    batch_size: int = 1024,
+) -> "hnswlib.Index":
+    """Build an approximate nearest-neighbor index over user rating vectors.
+
+    Args:
+        user_item_matrix: CSR user-item rating matrix
+        ef_construction: HNSW build-time beam width (higher = better recall)
+        m: Number of graph links per element
+        batch_size: Number of user rows densified at a time while adding
+
+    Returns:
+        hnswlib.Index in cosine space whose labels are matrix row indices
+
+    Cosine distance in hnswlib is 1 - cosine similarity, the same as
+    sklearn's metric="cosine", so scores are computed identically.
+    """
+    n_users, n_movies = user_item_matrix.shape
+    index = hnswlib.Index(space="cosine", dim=n_movies)
+    index.init_index(max_elements=n_users, ef_construction=ef_construction, M=m)
+    for start in range(0, n_users, batch_size):
+        stop = min(start + batch_size, n_users)
+        index.add_items(user_item_matrix[start:stop].toarray(), np.arange(start, stop))
+    return index
+
+
+def save_model_bundle(
+    user_item_matrix: csr_matrix,
+    user_id_to_idx: Dict[int, int],
+    movie_id_to_idx: Dict[int, int],
+    output_path: Path,
+    user_means: Optional[np.ndarray] = None,
+) -> None:
+    """Save all arrays the service needs into one uncompressed .npz bundle.
+
+    Args:
+        user_item_matrix: CSR user-item rating matrix
+        user_id_to_idx: User ID to row index mapping
+        movie_id_to_idx: Movie ID to column index mapping
+        output_path: Path of the .npz file to write
+        user_means: Per-user mean ratings, if the model was fit on
+            mean-centered ratings
+
+    The bundle holds the CSR components (data, indices, indptr, shape), the
+    ID mappings as sorted ID arrays plus matching index arrays (resolved
+    with np.searchsorted), and optionally user_means. It is written
+    uncompressed so the service can memory-map each array in place, and each
+    member is padded so its array data starts on a 64-byte boundary (np.savez
+    leaves it wherever the zip headers end, and misaligned arrays are slow).
+    """
+    arrays = {
+        "data": user_item_matrix.data,
+        "indices": user_item_matrix.indices,
+        "indptr": user_item_matrix.indptr,
+        "shape": np.array(user_item_matrix.shape, dtype=np.int64),
+    }
+    for name, id_to_idx in (("user", user_id_to_idx), ("movie", movie_id_to_idx)):
+        ids = np.fromiter(id_to_idx.keys(), dtype=np.int64, count=len(id_to_idx))
+        idx = np.fromiter(id_to_idx.values(), dtype=np.int64, count=len(id_to_idx))
+        order = np.argsort(ids)
+        arrays[f"{name}_ids_sorted"] = ids[order]
+        arrays[f"{name}_idx_of_sorted"] = idx[order]
+    if user_means is not None:
+        arrays["user_means"] = user_means
+
+    with open(output_path, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as zf:
+        for name, array in arrays.items():
+            info = zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0))
+            # The .npy header is itself padded to a multiple of 64 bytes, so
+            # aligning the start of the member aligns the array data. The
+            # local header is 30 bytes + name + zip64 extra (20 bytes) + this
+            # padding extra field (4-byte tag, id 0xD935 as used by zipalign).
+            unpadded = f.tell() + 30 + len(info.filename) + 20 + 4
+            info.extra = struct.pack("<HH", 0xD935, -unpadded % 64) + b"\0" * (-unpadded % 64)
+            with zf.open(info, "w", force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+
 
 def save_model_artifacts(
     model: NearestNeighbors,
@@ -142,6 +272,7 @@ def save_model_artifacts(
     user_id_to_idx: Dict[int, int],
     movie_id_to_idx: Dict[int, int],
     output_dir: Path,
+    user_means: Optional[np.ndarray] = None,
 ) -> None:
     """Save the trained model and associated data.
 
@@ -151,6 +282,8 @@ def save_model_artifacts(
         user_id_to_idx: User ID to index mapping
         movie_id_to_idx: Movie ID to index mapping
         output_dir: Directory to save artifacts
+        user_means: Per-user mean ratings, if the model was fit on
+            mean-centered ratings
 
     TODO: Implement this method
     Steps:
@@ -159,6 +292,9 @@ def save_model_artifacts(
     3. Save the matrix: joblib.dump(user_item_matrix, output_dir / "user_item_matrix.pkl")
     4. Save the mappings: joblib.dump(movie_id_to_idx, output_dir / "movie_id_to_idx.pkl")
     5. Optionally save user_id_to_idx if needed
+    6. Save user_means: joblib.dump(user_means, output_dir / "user_means.pkl"),
+       so loading from the pickles still un-centers the neighbor queries
+    7. Save the matrix, mappings and user_means in one memory-mappable bundle.npz
 
     The model file will be loaded by the gRPC service.
     """
@@ -167,6 +303,14 @@ def save_model_artifacts(
     joblib.dump(user_item_matrix, output_dir / "user_item_matrix.pkl")
     joblib.dump(movie_id_to_idx, output_dir / "movie_id_to_idx.pkl")
     joblib.dump(user_id_to_idx, output_dir / "user_id_to_idx.pkl")
+    if user_means is not None:
+        joblib.dump(user_means, output_dir / "user_means.pkl")
+    else:
+        # Don't leave a previous run's means next to an uncentered model
+        (output_dir / "user_means.pkl").unlink(missing_ok=True)
+    save_model_bundle(
+        user_item_matrix, user_id_to_idx, movie_id_to_idx, output_dir / "bundle.npz", user_means
+    )
 
 
 def main():
@@ -178,7 +322,9 @@ def main():
        - output_dir: Where to save trained model (e.g., 'models/')
     2. Load ratings data
     3. Create user-item matrix
-    4. Train the model
+    4. Train the model on mean-centered float32 ratings (the raw matrix is
+       kept for scoring, as int8; the service re-applies the centering
+       with user_means)
     5. Save everything
     6. Print statistics:
        - Number of users
@@ -197,8 +343,24 @@ def main():
 
     ratings_df = load_ratings(data_dir)
     user_item_matrix, user_id_to_idx, movie_id_to_idx = create_user_item_matrix(ratings_df)
-    model = train_collaborative_filtering_model(user_item_matrix)
-    save_model_artifacts(model, user_item_matrix, user_id_to_idx, movie_id_to_idx, output_dir)
+    centered_matrix, user_means = center_user_ratings(user_item_matrix)
+    model = train_collaborative_filtering_model(centered_matrix)
+    save_model_artifacts(
+        model,
+        compact_ratings(user_item_matrix),
+        user_id_to_idx,
+        movie_id_to_idx,
+        output_dir,
+        user_means,
+    )
+
+    if hnswlib is not None:
+        build_hnsw_index(centered_matrix).save_index(str(output_dir / "hnsw.bin"))
+        print("Saved HNSW index for approximate neighbor search")
+    else:
+        # An index from an earlier run would no longer match this matrix
+        (output_dir / "hnsw.bin").unlink(missing_ok=True)
+        print("hnswlib not installed; skipping HNSW index (service uses exact search)")
 
     n_users = user_item_matrix.shape[0]
     n_movies = user_item_matrix.shape[1]
@@ -216,6 +378,8 @@ def main():
     matrix_size = (output_dir / "user_item_matrix.pkl").stat().st_size / (1024 * 1024)
     print(f"Model file size: {model_size:.2f} MB")
     print(f"User-item matrix file size: {matrix_size:.2f} MB")
+    bundle_size = (output_dir / "bundle.npz").stat().st_size / (1024 * 1024)
+    print(f"Serving bundle file size: {bundle_size:.2f} MB")
 
 
 if __name__ == "__main__":